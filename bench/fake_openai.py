@@ -0,0 +1,227 @@
+"""Deterministic local stand-in for the OpenAI chat-completions and embeddings endpoints.
+
+Point the OpenAI client at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+Chat completions are answered from a script: a queue of scripted replies,
+each either a plain text answer or a list of tool calls. Embeddings are
+hashed bag-of-words vectors, so identical text always gets the same vector
+and text sharing content words gets similar ones.
+
+Provider-side prompt caching is simulated at message granularity: the
+longest run of tools + leading messages that an earlier request already
+sent is reported as `cached_tokens`, once it reaches the provider minimum.
+"""
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIM = 256
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from",
+    "how", "i", "if", "in", "is", "it", "my", "of", "on", "or", "our", "the", "to",
+    "we", "what", "when", "will", "with", "you", "your",
+}
+DEFAULT_REPLY = "Is there anything else I can help you with?"
+
+# Hashed bag-of-words vectors score lower than real embeddings; this plays the
+# role of knowledge_base.MIN_SIMILARITY when searching over fake embeddings
+FAKE_MIN_SIMILARITY = 0.15
+
+# Providers only cache prompt prefixes at least this long
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+
+def text_reply(content):
+    """A scripted reply that ends the tool-calling loop with `content`."""
+    return {"content": content}
+
+
+def tool_reply(*calls, content=None):
+    """A scripted reply asking for one or more tool calls.
+
+    Each call is a (function_name, arguments_dict) pair.
+    """
+    return {"content": content, "tool_calls": list(calls)}
+
+
+def fake_embedding(text):
+    """Hash each non-stopword into a fixed-size vector and L2-normalize it."""
+    counts = [0] * EMBEDDING_DIM
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if word not in STOPWORDS:
+            counts[zlib.crc32(word.encode("utf-8")) % EMBEDDING_DIM] += 1
+    vector = [1.0 + math.log(c) if c else 0.0 for c in counts]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def count_tokens(text):
+    """Rough token count (about four characters per token)."""
+    return max(1, len(text) // 4)
+
+
+class FakeOpenAI:
+    """Scripted fake backend plus the HTTP server that exposes it."""
+
+    def __init__(self, host="127.0.0.1", port=0, llm_latency_ms=0, embed_latency_ms=0):
+        self.llm_latency_ms = llm_latency_ms
+        self.embed_latency_ms = embed_latency_ms
+        self.chat_requests = 0
+        self.embedding_requests = 0
+        self._script = deque()
+        self._call_counter = 0
+        self._seen_prefixes = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def load_script(self, replies):
+        """Queue scripted replies for the next chat-completion requests."""
+        with self._lock:
+            self._script.extend(replies)
+
+    def pending(self):
+        """Number of scripted replies not consumed yet."""
+        with self._lock:
+            return len(self._script)
+
+    def clear_script(self):
+        with self._lock:
+            self._script.clear()
+
+    def _cached_prefix_tokens(self, body):
+        """Tokens of the longest request prefix an earlier request already sent."""
+        digest = hashlib.sha256()
+        length = 0
+        prefixes = []
+        for part in [body.get("tools", [])] + body.get("messages", []):
+            text = json.dumps(part)
+            digest.update(text.encode("utf-8"))
+            length += len(text)
+            prefixes.append((digest.hexdigest(), length))
+
+        cached_length = 0
+        with self._lock:
+            for key, prefix_length in prefixes:
+                if key not in self._seen_prefixes:
+                    break
+                cached_length = prefix_length
+            self._seen_prefixes.update(key for key, _ in prefixes)
+
+        cached_tokens = cached_length // 4
+        return cached_tokens if cached_tokens >= PROMPT_CACHE_MIN_TOKENS else 0
+
+    # --- Endpoint handlers ---
+
+    def chat_completion(self, body):
+        if self.llm_latency_ms:
+            time.sleep(self.llm_latency_ms / 1000)
+
+        with self._lock:
+            self.chat_requests += 1
+            reply = self._script.popleft() if self._script else text_reply(DEFAULT_REPLY)
+            tool_calls = []
+            for name, arguments in reply.get("tool_calls", []):
+                self._call_counter += 1
+                tool_calls.append({
+                    "id": f"call_{self._call_counter:06d}",
+                    "type": "function",
+                    "function": {"name": name, "arguments": json.dumps(arguments)},
+                })
+
+        message = {"role": "assistant", "content": reply.get("content")}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+
+        prompt_tokens = count_tokens(json.dumps(body.get("messages", [])))
+        prompt_tokens += count_tokens(json.dumps(body.get("tools", [])))
+        completion_tokens = count_tokens(json.dumps(message))
+        cached_tokens = min(self._cached_prefix_tokens(body), prompt_tokens)
+
+        return {
+            "id": f"chatcmpl-fake-{self.chat_requests}",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": message,
+                "finish_reason": "tool_calls" if tool_calls else "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+    def embeddings(self, body):
+        if self.embed_latency_ms:
+            time.sleep(self.embed_latency_ms / 1000)
+
+        with self._lock:
+            self.embedding_requests += 1
+
+        inputs = body.get("input", "")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+
+        tokens = sum(count_tokens(text) for text in inputs)
+        return {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text)}
+                for i, text in enumerate(inputs)
+            ],
+            "model": body.get("model", "fake"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+
+                if self.path.endswith("/chat/completions"):
+                    payload = fake.chat_completion(body)
+                elif self.path.endswith("/embeddings"):
+                    payload = fake.embeddings(body)
+                else:
+                    self.send_error(404)
+                    return
+
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,76 @@
+"""Check that every LLM request starts with the same bytes.
+
+Provider-side prompt caching only helps if the tools and the static system
+prompt form an identical prefix on every request. This builds opening
+requests for new and returning customers on different days and fails if
+that prefix differs between any of them, or if a date leaks into it.
+
+Usage (from the repository root):
+    python -m bench.prefix_stability
+
+Exits with status 1 on failure. No API calls are made.
+"""
+import json
+import os
+import sys
+import tempfile
+from datetime import date
+
+DAYS = [date(2025, 1, 1), date(2025, 7, 4), date(2026, 12, 31)]
+
+
+def request_prefix(messages, tools):
+    """Serialize the part of a request that must be cacheable: tools + first message."""
+    return json.dumps(tools) + json.dumps(messages[0])
+
+
+def main():
+    os.environ.setdefault("OPENAI_API_KEY", "bench")  # main.py builds its client at import
+
+    import database
+    import main as agent
+    from bench.scenarios import seed_returning_customer
+    from tools import TOOLS
+
+    failures = []
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database.DB_PATH = os.path.join(workdir, "prefix.db")
+        database.init_db()
+        seed_returning_customer("5125550001")
+
+        requests = {}
+        for day in DAYS:
+            for label, phone in (("new", "5125550000"), ("returning", "5125550001")):
+                messages, past = agent.start_conversation(phone, today=day)
+                if (label == "returning") != bool(past):
+                    failures.append(f"{label} customer on {day}: history not loaded as expected")
+                requests[f"{label} customer on {day}"] = messages
+
+    prefixes = {name: request_prefix(messages, TOOLS) for name, messages in requests.items()}
+    reference_name, reference = next(iter(prefixes.items()))
+
+    for name, prefix in prefixes.items():
+        if prefix != reference:
+            failures.append(f"prefix for {name} differs from {reference_name}")
+
+    for day in DAYS:
+        for text in (day.strftime("%B %d, %Y"), day.isoformat()):
+            if text in reference:
+                failures.append(f"date {text!r} appears in the static prefix")
+
+    # The session context must still tell the model today's date
+    for name, messages in requests.items():
+        if not any(day.strftime("%B %d, %Y") in messages[1]["content"] for day in DAYS):
+            failures.append(f"{name}: date missing from the session context message")
+
+    print(f"Requests compared: {len(prefixes)}")
+    print(f"Static prefix:     {len(reference)} bytes (~{len(reference) // 4} tokens)")
+    for line in failures:
+        print(f"  FAIL: {line}")
+    print("\nOK" if not failures else "\nFAILED")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Chunk statistics and retrieval quality for the knowledge base.
+
+Chunks the knowledge/ corpus, embeds it, and runs the labelled queries in
+bench/retrieval_queries.json through search_knowledge. A query is a hit at
+rank r if the r-th result contains its expected passage.
+
+Usage (from the repository root):
+    python -m bench.retrieval                   # offline, hashed fake embeddings
+    python -m bench.retrieval --live            # real OpenAI embeddings (needs OPENAI_API_KEY)
+    python -m bench.retrieval --max-tokens 120 --overlap 20
+    python -m bench.retrieval --min-similarity 0 --mmr-lambda 1 --budget 100000   # plain top-k
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+
+from bench.fake_openai import FAKE_MIN_SIMILARITY, FakeOpenAI
+
+QUERIES_PATH = os.path.join(os.path.dirname(__file__), "retrieval_queries.json")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Knowledge base chunking and retrieval report")
+    parser.add_argument("--live", action="store_true", help="Use the real OpenAI embeddings endpoint")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--max-tokens", type=int, help="Override MAX_CHUNK_TOKENS")
+    parser.add_argument("--min-tokens", type=int, help="Override MIN_CHUNK_TOKENS")
+    parser.add_argument("--overlap", type=int, help="Override CHUNK_OVERLAP_TOKENS")
+    parser.add_argument("--min-similarity", type=float, help="Override MIN_SIMILARITY")
+    parser.add_argument("--mmr-lambda", type=float, help="Override MMR_LAMBDA")
+    parser.add_argument("--budget", type=int, help="Override RESULT_TOKEN_BUDGET")
+    parser.add_argument("--queries", default=QUERIES_PATH)
+    return parser.parse_args(argv)
+
+
+def evaluate(queries, top_k):
+    """Return hit@1, hit@k, MRR and mean result tokens over the labelled queries."""
+    import knowledge_base
+
+    hits_at_1 = hits_at_k = empty = 0
+    reciprocal_ranks = 0.0
+    result_tokens = 0
+    misses = []
+
+    for item in queries:
+        results = knowledge_base.search_knowledge(item["query"], top_k=top_k)
+        result_tokens += sum(knowledge_base.count_tokens(r["content"]) for r in results)
+        empty += not results
+
+        rank = next(
+            (i + 1 for i, r in enumerate(results) if item["expect"].lower() in r["content"].lower()),
+            None,
+        )
+        if rank is None:
+            misses.append(item["query"])
+            continue
+        hits_at_k += 1
+        hits_at_1 += rank == 1
+        reciprocal_ranks += 1 / rank
+
+    n = len(queries)
+    return {
+        "queries": n,
+        "hit_at_1": hits_at_1 / n,
+        f"hit_at_{top_k}": hits_at_k / n,
+        "mrr": reciprocal_ranks / n,
+        "mean_result_tokens": result_tokens / n,
+        "empty_results": empty / n,
+        "misses": misses,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    fake = None
+    if not args.live:
+        fake = FakeOpenAI().start()
+        os.environ["OPENAI_BASE_URL"] = fake.base_url
+        os.environ["OPENAI_API_KEY"] = "bench"
+
+    import knowledge_base
+
+    if fake:
+        knowledge_base.MIN_SIMILARITY = FAKE_MIN_SIMILARITY
+    if args.max_tokens:
+        knowledge_base.MAX_CHUNK_TOKENS = args.max_tokens
+    if args.min_tokens:
+        knowledge_base.MIN_CHUNK_TOKENS = args.min_tokens
+    if args.overlap is not None:
+        knowledge_base.CHUNK_OVERLAP_TOKENS = args.overlap
+    if args.min_similarity is not None:
+        knowledge_base.MIN_SIMILARITY = args.min_similarity
+    if args.mmr_lambda is not None:
+        knowledge_base.MMR_LAMBDA = args.mmr_lambda
+    if args.budget:
+        knowledge_base.RESULT_TOKEN_BUDGET = args.budget
+
+    with open(args.queries) as f:
+        queries = json.load(f)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        knowledge_base.KNOWLEDGE_DIR = os.path.join(REPO_ROOT, "knowledge")
+        knowledge_base.EMBEDDINGS_CACHE = os.path.join(workdir, "knowledge_embeddings.json")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            chunks = knowledge_base.build_knowledge_base()
+            report = evaluate(queries, args.top_k)
+
+    if fake:
+        fake.stop()
+
+    print("Chunk statistics:")
+    for source, stats in knowledge_base.chunk_stats(chunks).items():
+        print(f"  {source:<28} {stats['chunks']:>3} chunks, "
+              f"{stats['min_tokens']}-{stats['max_tokens']} tokens (mean {stats['mean_tokens']:.0f})")
+
+    print(f"\nRetrieval ({'live' if args.live else 'fake'} embeddings, {report['queries']} queries):")
+    for key, value in report.items():
+        if key in ("queries", "misses"):
+            continue
+        print(f"  {key:<20} {value:.3f}")
+    for query in report["misses"]:
+        print(f"  miss: {query}")
+
+
+if __name__ == "__main__":
+    main()
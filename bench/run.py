@@ -0,0 +1,228 @@
+"""Offline end-to-end benchmark for the agent loop.
+
+Runs the scripted scenarios in bench/scenarios.py through the real main.chat,
+tools and knowledge_base code, with OpenAI replaced by the local fake in
+bench/fake_openai.py and the database in a temporary directory.
+
+Usage (from the repository root):
+    python -m bench.run                        # run and compare against bench/baseline.json
+    python -m bench.run --update-baseline      # record a new baseline
+    python -m bench.run --llm-latency-ms 300   # simulate a slower model
+
+Exits with status 1 if any metric regresses past its tolerance, so it can
+gate CI.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench.fake_openai import FAKE_MIN_SIMILARITY, FakeOpenAI
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# BEGIN/COMMIT/ROLLBACK are timed but not counted as DB ops
+TRANSACTION_SPANS = ("db.begin", "db.commit", "db.rollback")
+
+# metric -> (which direction is better, tolerance group)
+CHECKS = {
+    "turns_per_sec": ("higher", "timing"),
+    "turn_p95_ms": ("lower", "timing"),
+    "llm_calls_per_turn": ("lower", "count"),
+    "embedding_calls_per_turn": ("lower", "count"),
+    "db_ops_per_turn": ("lower", "count"),
+    "prompt_tokens_per_turn": ("lower", "count"),
+    "cached_prompt_ratio": ("higher", "count"),
+    "peak_memory_kb": ("lower", "memory"),
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline agent-loop benchmark")
+    parser.add_argument("--iterations", type=int, default=20, help="Sessions per scenario")
+    parser.add_argument("--scenario", action="append", help="Run only this scenario (repeatable)")
+    parser.add_argument("--llm-latency-ms", type=float, default=0)
+    parser.add_argument("--embed-latency-ms", type=float, default=0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="Also write the results as JSON to this path")
+    parser.add_argument("--timing-tolerance", type=float, default=0.5,
+                        help="Allowed relative slowdown for latency/throughput (machine dependent)")
+    parser.add_argument("--count-tolerance", type=float, default=0.05,
+                        help="Allowed relative increase for call, DB op and token counts")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25)
+    return parser.parse_args(argv)
+
+
+def run_scenario(name, iterations, fake, workdir):
+    """Run one scenario `iterations` times and return its metrics."""
+    import database
+    import main
+    import telemetry
+    from bench.scenarios import SCENARIOS
+
+    build_turns, setup = SCENARIOS[name]
+    database.DB_PATH = os.path.join(workdir, f"{name}.db")
+    database.init_db()
+
+    phones = [f"512555{i:04d}" for i in range(iterations)]
+    if setup:
+        for phone in phones:
+            setup(phone)
+
+    llm_before, embed_before = fake.chat_requests, fake.embedding_requests
+    telemetry.reset()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    for phone in phones:
+        conversation_history, _ = main.start_conversation(phone)
+        for turn in build_turns(phone):
+            fake.load_script(turn["replies"])
+            with telemetry.span("bench.turn"):
+                if turn["user"] is not None:
+                    user_msg = {"role": "user", "content": turn["user"]}
+                    conversation_history.append(user_msg)
+                    database.save_message(phone, user_msg)
+                main.chat(conversation_history, phone)
+            if fake.pending():
+                fake.clear_script()
+                raise RuntimeError(f"{name}: turn ended before all scripted replies were used")
+
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = telemetry.summary()
+    spans = stats["spans"]
+    turns = spans["bench.turn"]["count"]
+
+    def total(prefix, key):
+        return sum(s[key] for span_name, s in spans.items() if span_name.startswith(prefix))
+
+    return {
+        "turns": turns,
+        "turns_per_sec": turns / elapsed,
+        "turn_p50_ms": spans["bench.turn"]["p50_ms"],
+        "turn_p95_ms": spans["bench.turn"]["p95_ms"],
+        "turn_p99_ms": spans["bench.turn"]["p99_ms"],
+        # Nested spans overlap (tool time includes its embeddings and DB time)
+        "breakdown_ms_per_turn": {
+            category: total(category + ".", "sum_ms") / turns
+            for category in ("llm", "tool", "embeddings", "db")
+        },
+        "llm_calls_per_turn": (fake.chat_requests - llm_before) / turns,
+        "embedding_calls_per_turn": (fake.embedding_requests - embed_before) / turns,
+        "db_ops_per_turn": (total("db.", "count") - sum(
+            spans.get(name, {}).get("count", 0) for name in TRANSACTION_SPANS)) / turns,
+        "prompt_tokens_per_turn": stats["counters"].get("llm.prompt_tokens", 0) / turns,
+        "cached_prompt_ratio": (stats["counters"].get("llm.cached_tokens", 0)
+                                / (stats["counters"].get("llm.prompt_tokens", 0) or 1)),
+        "peak_memory_kb": peak / 1024,
+    }
+
+
+def compare(results, baseline, tolerances):
+    """Return a list of human-readable regressions against the baseline."""
+    regressions = []
+    for name, metrics in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        for metric, (better, group) in CHECKS.items():
+            old, new = expected.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            tolerance = tolerances[group]
+            if better == "higher" and new < old * (1 - tolerance):
+                regressions.append(f"{name}.{metric}: {new:.2f} < {old:.2f} (-{tolerance:.0%} allowed)")
+            elif better == "lower" and new > old * (1 + tolerance):
+                regressions.append(f"{name}.{metric}: {new:.2f} > {old:.2f} (+{tolerance:.0%} allowed)")
+    return regressions
+
+
+def print_results(results):
+    header = f"{'scenario':<22}{'turns/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'llm/t':>7}{'emb/t':>7}{'db/t':>7}{'tok/t':>8}{'cache%':>8}{'peak KB':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, m in results.items():
+        print(f"{name:<22}{m['turns_per_sec']:>9.1f}{m['turn_p50_ms']:>9.2f}{m['turn_p95_ms']:>9.2f}"
+              f"{m['llm_calls_per_turn']:>7.2f}{m['embedding_calls_per_turn']:>7.2f}"
+              f"{m['db_ops_per_turn']:>7.1f}{m['prompt_tokens_per_turn']:>8.0f}"
+              f"{m['cached_prompt_ratio']:>8.0%}{m['peak_memory_kb']:>10.0f}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    fake = FakeOpenAI(llm_latency_ms=args.llm_latency_ms, embed_latency_ms=args.embed_latency_ms).start()
+    os.environ["OPENAI_BASE_URL"] = fake.base_url
+    os.environ["OPENAI_API_KEY"] = "bench"
+
+    # Import after the environment points at the fake, since the modules
+    # create their OpenAI clients at import time
+    import knowledge_base
+    import telemetry
+    from bench.scenarios import SCENARIOS
+
+    telemetry.enable()
+    knowledge_base.MIN_SIMILARITY = FAKE_MIN_SIMILARITY
+    names = args.scenario or list(SCENARIOS)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        knowledge_base.KNOWLEDGE_DIR = os.path.join(REPO_ROOT, "knowledge")
+        knowledge_base.EMBEDDINGS_CACHE = os.path.join(workdir, "knowledge_embeddings.json")
+
+        results = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            knowledge_base.build_knowledge_base()  # Embed the corpus once, outside the measurements
+
+            # One untimed session per scenario so client setup and lazy imports
+            # don't land in the first scenario's numbers
+            warmup_dir = os.path.join(workdir, "warmup")
+            os.mkdir(warmup_dir)
+            for name in names:
+                run_scenario(name, 1, fake, warmup_dir)
+
+            for name in names:
+                results[name] = run_scenario(name, args.iterations, fake, workdir)
+
+    fake.stop()
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, {
+        "timing": args.timing_tolerance,
+        "count": args.count_tolerance,
+        "memory": args.memory_tolerance,
+    })
+    if regressions:
+        print("\nRegressions against baseline:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+
+    print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
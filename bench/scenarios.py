@@ -0,0 +1,116 @@
+"""Scripted benchmark scenarios.
+
+Each scenario is a list of turns. A turn is the user's message (None for the
+opening greeting) and the scripted LLM replies that the fake backend hands
+back while main.chat runs its tool-calling loop for that turn.
+"""
+from bench.fake_openai import text_reply, tool_reply
+from database import save_booking, save_customer, save_message
+
+
+def _booking_args(phone):
+    return {
+        "customer_name": "Dana Whitfield",
+        "address": "1200 Oak Creek Dr, Round Rock, TX 78664",
+        "phone": phone,
+        "service_category": "hvac",
+        "issue_description": "AC running but not cooling",
+        "preferred_date": "2025-10-15",
+        "preferred_time": "morning",
+        "urgency": "soon",
+    }
+
+
+def new_customer_booking(phone):
+    return [
+        {"user": None, "replies": [
+            text_reply("Hi, thanks for contacting Pinnacle Home Services! How can I help today?"),
+        ]},
+        {"user": "My AC is running but not cooling. I'm in Round Rock, 78664.", "replies": [
+            tool_reply(("check_service_area", {"city": "Round Rock", "zip_code": "78664"})),
+            tool_reply(("get_price_estimate", {"service_category": "hvac", "job_type": "AC not cooling"})),
+            text_reply("Good news, you're in our service area. AC repairs usually run $200-$600. "
+                       "What's your name, address and a good time for a visit?"),
+        ]},
+        {"user": f"Dana Whitfield, 1200 Oak Creek Dr. Tomorrow morning works. My number is {phone}.", "replies": [
+            tool_reply(("book_appointment", _booking_args(phone))),
+            text_reply("You're booked for tomorrow morning. We'll call to confirm within an hour."),
+        ]},
+    ]
+
+
+def returning_customer(phone):
+    return [
+        {"user": None, "replies": [
+            tool_reply(("lookup_customer", {"phone": phone})),
+            text_reply("Welcome back, Dana! How is the AC holding up?"),
+        ]},
+        {"user": "It's fine, but now the kitchen sink is clogged.", "replies": [
+            tool_reply(("get_price_estimate", {"service_category": "plumbing", "job_type": "clogged drain"})),
+            text_reply("Drain cleaning typically runs $150-$300. Same address as last time?"),
+        ]},
+        {"user": "Yes, same address. Friday afternoon please.", "replies": [
+            tool_reply(("book_appointment", {
+                **_booking_args(phone),
+                "service_category": "plumbing",
+                "issue_description": "Clogged kitchen sink",
+                "preferred_time": "afternoon",
+                "urgency": "routine",
+            })),
+            text_reply("Done! You're booked for Friday afternoon."),
+        ]},
+    ]
+
+
+def seed_returning_customer(phone):
+    """Give the customer a previous session and booking to load."""
+    save_customer("Dana Whitfield", phone, "1200 Oak Creek Dr, Round Rock, TX 78664")
+    save_booking({
+        **_booking_args(phone),
+        "confirmation_number": f"PHS-SEED{phone[-4:]}",
+        "status": "confirmed",
+    })
+    for i in range(12):
+        save_message(phone, {"role": "user", "content": f"Earlier question number {i} about my AC unit."})
+        save_message(phone, {"role": "assistant", "content": f"Earlier answer number {i} about the AC unit."})
+
+
+def faq_heavy(phone):
+    questions = [
+        ("Do you offer free estimates?", "free estimates diagnostic fee"),
+        ("What payment methods do you take?", "payment methods accepted"),
+        ("Is the work under warranty?", "warranty policy"),
+        ("How should I prepare for an HVAC visit?", "how to prepare for HVAC appointment"),
+        ("Do you offer financing?", "financing options"),
+    ]
+    turns = [{"user": None, "replies": [text_reply("Hi! What can I help you with?")]}]
+    for question, query in questions:
+        turns.append({"user": question, "replies": [
+            tool_reply(("search_knowledge_base", {"query": query})),
+            text_reply("Here's what our policy says."),
+        ]})
+    return turns
+
+
+def multi_tool_turn(phone):
+    return [
+        {"user": None, "replies": [text_reply("Hi! What can I help you with?")]},
+        {"user": f"I'm at 78701, need an outlet fixed, what's your warranty? Phone {phone}.", "replies": [
+            tool_reply(
+                ("lookup_customer", {"phone": phone}),
+                ("check_service_area", {"zip_code": "78701"}),
+                ("get_price_estimate", {"service_category": "electrical", "job_type": "outlet repair"}),
+                ("search_knowledge_base", {"query": "warranty policy electrical work"}),
+            ),
+            text_reply("You're in our area, outlet repairs run $100-$200, and all work carries our warranty."),
+        ]},
+    ]
+
+
+# name -> (build_turns(phone), optional setup(phone))
+SCENARIOS = {
+    "new_customer_booking": (new_customer_booking, None),
+    "returning_customer": (returning_customer, seed_returning_customer),
+    "faq_heavy": (faq_heavy, None),
+    "multi_tool_turn": (multi_tool_turn, None),
+}
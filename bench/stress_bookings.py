@@ -0,0 +1,123 @@
+"""Concurrent booking stress test.
+
+Many threads call book_appointment through execute_tool at once against a
+fresh database file. A share of the tool calls is sent twice with the same
+tool_call_id, racing each other on different threads, the way a retried
+tool call would. Afterwards every call must have produced exactly one
+booking and one customer row.
+
+Usage (from the repository root):
+    python -m bench.stress_bookings
+    python -m bench.stress_bookings --threads 64 --bookings 2000 --retry-rate 0.5
+
+Exits with status 1 if any booking is lost or duplicated, or any call fails.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent booking stress test")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--bookings", type=int, default=1000, help="Distinct tool calls to make")
+    parser.add_argument("--retry-rate", type=float, default=0.3,
+                        help="Fraction of tool calls that are sent a second time")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def booking_args(i):
+    return {
+        "customer_name": f"Stress Customer {i}",
+        "address": f"{100 + i} Congress Ave, Austin, TX 78701",
+        "phone": f"512{i:07d}",
+        "service_category": "plumbing",
+        "issue_description": "Leaky faucet",
+        "preferred_date": "2025-10-15",
+        "preferred_time": "morning",
+        "urgency": "routine",
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    import database
+    import telemetry
+    from tools import execute_tool
+
+    telemetry.enable()
+    rng = random.Random(args.seed)
+
+    calls = [(f"call_{i:06d}", booking_args(i)) for i in range(args.bookings)]
+    retried = [call for call in calls if rng.random() < args.retry_rate]
+    jobs = calls + retried
+    rng.shuffle(jobs)
+
+    errors = []
+
+    def run(job):
+        tool_call_id, arguments = job
+        try:
+            return tool_call_id, execute_tool("book_appointment", arguments, tool_call_id)
+        except Exception as e:  # Report every failure, not just the first
+            errors.append(f"{tool_call_id}: {type(e).__name__}: {e}")
+            return tool_call_id, None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database.DB_PATH = os.path.join(workdir, "stress.db")
+        database.init_db()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            results = list(pool.map(run, jobs))
+        elapsed = time.perf_counter() - start
+
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT idempotency_key, confirmation_number FROM bookings")
+        rows = cursor.fetchall()
+        cursor.execute("SELECT COUNT(*) FROM customers")
+        customer_count = cursor.fetchone()[0]
+        conn.close()
+
+    stored = {}
+    duplicates = 0
+    for row in rows:
+        if row["idempotency_key"] in stored:
+            duplicates += 1
+        stored[row["idempotency_key"]] = row["confirmation_number"]
+
+    expected = {tool_call_id for tool_call_id, _ in calls}
+    lost = expected - set(stored)
+
+    # Both sends of a retried call must report the same confirmation number
+    mismatched = sum(
+        1 for tool_call_id, result in results
+        if result and result["confirmation_number"] != stored.get(tool_call_id)
+    )
+
+    print(f"Tool calls:        {len(jobs)} ({len(retried)} retried) on {args.threads} threads")
+    print(f"Elapsed:           {elapsed:.2f}s ({len(jobs) / elapsed:.0f} calls/sec)")
+    print(f"Bookings stored:   {len(rows)} (expected {len(calls)})")
+    print(f"Customers stored:  {customer_count} (expected {len(calls)})")
+    print(f"Lost bookings:     {len(lost)}")
+    print(f"Duplicate rows:    {duplicates}")
+    print(f"Mismatched replies:{mismatched:>2}")
+    print(f"Write retries:     {telemetry.counters().get('db.write_retries', 0):g}")
+    print(f"Errors:            {len(errors)}")
+    for line in errors[:10]:
+        print(f"  {line}")
+
+    ok = not (lost or duplicates or mismatched or errors) and len(rows) == len(calls) == customer_count
+    print("\nOK" if ok else "\nFAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,116 @@
 import sqlite3
 import json
-from datetime import datetime
+import random
+import time
+import zlib
+from datetime import datetime, timedelta
+import telemetry
+
+try:
+    import zstandard
+except ImportError:  # Optional: fall back to zlib for archive blobs
+    zstandard = None
 
 DB_PATH = "pinnacle.db"
 
+# Write concurrency: how long SQLite waits for a lock, then how often we retry
+BUSY_TIMEOUT_SECONDS = 5
+WRITE_RETRIES = 5
+WRITE_BACKOFF_SECONDS = 0.05
+
+# Conversation archiving: messages older than this move to conversation_archive
+ARCHIVE_AFTER_DAYS = 30
+# Messages further apart than this start a new archived session
+SESSION_GAP_MINUTES = 30
+# The newest messages per customer always stay hot (matches get_conversation_history)
+HOT_MESSAGES_PER_CUSTOMER = 20
+# Pages released per incremental vacuum transaction (4 MB at the default page size)
+VACUUM_STEP_PAGES = 1000
+# Pause between archive and vacuum transactions; without it a session waiting
+# on the busy timeout keeps missing the brief gaps between them
+ARCHIVE_BATCH_PAUSE_SECONDS = 0.005
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that records a telemetry span for every statement it runs."""
+
+    def execute(self, sql, parameters=()):
+        verb = sql.split(None, 1)[0].upper() if sql.strip() else "EMPTY"
+        with telemetry.span(f"db.{verb.lower()}"):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        verb = sql.split(None, 1)[0].upper() if sql.strip() else "EMPTY"
+        with telemetry.span(f"db.{verb.lower()}"):
+            return super().executemany(sql, seq_of_parameters)
+
+
+class TracedConnection(sqlite3.Connection):
+    """Connection whose cursors are TracedCursors."""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
 
 def get_connection():
-    """Get a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_PATH)
+    """Get a connection to the SQLite database.
+
+    When tracing is enabled, every statement is timed via TracedCursor.
+    """
+    factory = TracedConnection if telemetry.ENABLED else sqlite3.Connection
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_SECONDS, factory=factory)
     conn.row_factory = sqlite3.Row
     return conn
 
 
+def _is_busy(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def run_write(work):
+    """Run `work(cursor)` inside a BEGIN IMMEDIATE transaction and return its result.
+
+    BEGIN IMMEDIATE takes the write lock up front, so concurrent sessions
+    queue on SQLite's busy timeout instead of deadlocking while upgrading a
+    read lock. If the lock still can't be had, the whole transaction is
+    retried with exponential backoff and jitter, up to WRITE_RETRIES times.
+    """
+    for attempt in range(WRITE_RETRIES + 1):
+        conn = get_connection()
+        conn.isolation_level = None  # We issue BEGIN/COMMIT ourselves
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(cursor)
+                cursor.execute("COMMIT")
+                return result
+            except BaseException:
+                conn.rollback()
+                raise
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e) or attempt == WRITE_RETRIES:
+                raise
+            telemetry.incr("db.write_retries")
+        finally:
+            conn.close()
+
+        time.sleep(WRITE_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
 def init_db():
     """Create the database tables if they don't exist."""
     conn = get_connection()
     cursor = conn.cursor()
 
+    # Lets compaction hand freed pages back a few at a time instead of a full VACUUM.
+    # Only takes effect on a brand-new database file.
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+    # WAL lets readers keep going while a session is writing
+    cursor.execute("PRAGMA journal_mode = WAL")
+
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS customers (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -39,6 +133,30 @@ def init_db():
         )
     """)
 
+    # Keeps the "last N messages for this customer" query an index range scan
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversations_customer
+        ON conversations (customer_phone, id)
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_phone TEXT,
+            session_start TEXT,
+            session_end TEXT,
+            message_count INTEGER,
+            codec TEXT,
+            payload BLOB,
+            archived_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_archive_customer
+        ON conversation_archive (customer_phone, session_start)
+    """)
+
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS bookings (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -52,10 +170,21 @@ def init_db():
             preferred_time TEXT,
             urgency TEXT,
             status TEXT DEFAULT 'confirmed',
+            idempotency_key TEXT,
             created_at TEXT DEFAULT CURRENT_TIMESTAMP
         )
     """)
 
+    # Older databases predate idempotency keys
+    cursor.execute("PRAGMA table_info(bookings)")
+    if "idempotency_key" not in {row["name"] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE bookings ADD COLUMN idempotency_key TEXT")
+
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_bookings_idempotency
+        ON bookings (idempotency_key)
+    """)
+
     conn.commit()
     conn.close()
 
@@ -74,8 +203,10 @@ def get_customer(phone):
 
 def save_customer(name, phone, address=None):
     """Save or update a customer record."""
-    conn = get_connection()
-    cursor = conn.cursor()
+    run_write(lambda cursor: _upsert_customer(cursor, name, phone, address))
+
+
+def _upsert_customer(cursor, name, phone, address):
     cursor.execute("""
         INSERT INTO customers (name, phone, address)
         VALUES (?, ?, ?)
@@ -83,22 +214,17 @@ def save_customer(name, phone, address=None):
             name = excluded.name,
             address = COALESCE(excluded.address, customers.address)
     """, (name, phone, address))
-    conn.commit()
-    conn.close()
 
 
 # --- Conversation Functions ---
 
 def save_message(customer_phone, message):
     """Save a single message to the conversation history."""
-    conn = get_connection()
-    cursor = conn.cursor()
-
     tool_calls = None
     if message.get("tool_calls"):
         tool_calls = json.dumps(message["tool_calls"])
 
-    cursor.execute("""
+    run_write(lambda cursor: cursor.execute("""
         INSERT INTO conversations (customer_phone, role, content, tool_calls, tool_call_id)
         VALUES (?, ?, ?, ?, ?)
     """, (
@@ -107,12 +233,10 @@ def save_message(customer_phone, message):
         message.get("content"),
         tool_calls,
         message.get("tool_call_id")
-    ))
-    conn.commit()
-    conn.close()
+    )))
 
 
-def get_conversation_history(customer_phone, limit=20):
+def get_conversation_history(customer_phone, limit=HOT_MESSAGES_PER_CUSTOMER):
     """Load recent conversation history for a customer.
 
     Returns the last `limit` messages to keep context manageable.
@@ -131,30 +255,260 @@ def get_conversation_history(customer_phone, limit=20):
     conn.close()
 
     # Reverse so they're in chronological order
-    messages = []
-    for row in reversed(rows):
-        msg = {"role": row["role"], "content": row["content"]}
-        if row["tool_calls"]:
-            msg["tool_calls"] = json.loads(row["tool_calls"])
-        if row["tool_call_id"]:
-            msg["tool_call_id"] = row["tool_call_id"]
-        messages.append(msg)
+    return [_row_to_message(row) for row in reversed(rows)]
+
+
+def _row_to_message(row):
+    """Turn a stored conversation row back into an OpenAI-style message."""
+    msg = {"role": row["role"], "content": row["content"]}
+    if row["tool_calls"]:
+        msg["tool_calls"] = json.loads(row["tool_calls"])
+    if row["tool_call_id"]:
+        msg["tool_call_id"] = row["tool_call_id"]
+    return msg
+
+
+# --- Conversation Archive Functions ---
+
+def _compress(data):
+    """Compress bytes with zstd when available, zlib otherwise."""
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "zlib", zlib.compress(data, 9)
+
+
+def _decompress(codec, payload):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This archive was written with zstd; install the 'zstandard' package to read it.")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+
+def _split_sessions(rows):
+    """Group one customer's rows (in id order) into sessions by time gap."""
+    sessions = []
+    last_time = None
+    for row in rows:
+        created = datetime.strptime(row["created_at"], "%Y-%m-%d %H:%M:%S")
+        if last_time is None or created - last_time > timedelta(minutes=SESSION_GAP_MINUTES):
+            sessions.append([])
+        sessions[-1].append(row)
+        last_time = created
+    return sessions
+
+
+def _archive_customer(cursor, rows):
+    """Write one customer's old rows as compressed session blobs. Returns the session count."""
+    sessions = _split_sessions(rows)
+    for session in sessions:
+        payload = json.dumps([
+            {
+                "role": row["role"],
+                "content": row["content"],
+                "tool_calls": row["tool_calls"],
+                "tool_call_id": row["tool_call_id"],
+                "created_at": row["created_at"],
+            }
+            for row in session
+        ]).encode("utf-8")
+        codec, blob = _compress(payload)
+        cursor.execute("""
+            INSERT INTO conversation_archive (
+                customer_phone, session_start, session_end, message_count, codec, payload
+            ) VALUES (?, ?, ?, ?, ?, ?)
+        """, (
+            session[0]["customer_phone"],
+            session[0]["created_at"],
+            session[-1]["created_at"],
+            len(session),
+            codec,
+            blob
+        ))
+    return len(sessions)
 
-    return messages
+
+def archive_old_conversations(max_age_days=ARCHIVE_AFTER_DAYS, keep_recent=HOT_MESSAGES_PER_CUSTOMER,
+                              full_vacuum=False):
+    """Move old conversation rows out of the hot table into compressed session blobs.
+
+    A row is archived when it is older than `max_age_days` and not among the
+    `keep_recent` newest messages for its customer, so returning-customer
+    context loaded by get_conversation_history is unaffected.
+
+    Each customer is archived in its own short write transaction, so live
+    sessions only ever wait on one customer's rows. Afterwards the freed
+    pages are handed back to the filesystem and the query planner statistics
+    are refreshed. Databases created before auto_vacuum was turned on can't
+    release pages incrementally; pass `full_vacuum=True` to convert them with
+    a one-time VACUUM (this locks the database while it rewrites the file).
+
+    Returns counts of archived messages and sessions, and of freed pages.
+    """
+    cutoff = f"-{max_age_days} days"
+
+    # Plain read: under WAL it doesn't block the writers
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT DISTINCT customer_phone FROM conversations
+        WHERE created_at < datetime('now', ?)
+    """, (cutoff,))
+    phones = [row["customer_phone"] for row in cursor.fetchall()]
+    conn.close()
+
+    archived_messages = archived_sessions = 0
+    for phone in phones:
+        messages, sessions = run_write(
+            lambda cursor, phone=phone: _archive_rows(cursor, phone, cutoff, keep_recent))
+        archived_messages += messages
+        archived_sessions += sessions
+        time.sleep(ARCHIVE_BATCH_PAUSE_SECONDS)
+
+    freed_pages = 0
+    if archived_messages or full_vacuum:
+        freed_pages = _release_free_pages(full_vacuum)
+
+    return {
+        "archived_messages": archived_messages,
+        "archived_sessions": archived_sessions,
+        "freed_pages": freed_pages,
+    }
+
+
+def _archive_rows(cursor, customer_phone, cutoff, keep_recent):
+    """Archive and delete one customer's eligible rows. Returns (message count, session count)."""
+    cursor.execute("""
+        SELECT id, customer_phone, role, content, tool_calls, tool_call_id, created_at
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (ORDER BY id DESC) AS recency
+            FROM conversations
+            WHERE customer_phone = ?
+        )
+        WHERE recency > ? AND created_at < datetime('now', ?)
+        ORDER BY id
+    """, (customer_phone, keep_recent, cutoff))
+    rows = cursor.fetchall()
+    if not rows:
+        return 0, 0
+
+    session_count = _archive_customer(cursor, rows)
+    cursor.executemany("DELETE FROM conversations WHERE id = ?", [(row["id"],) for row in rows])
+    return len(rows), session_count
+
+
+def _release_free_pages(full_vacuum=False):
+    """Give free pages back to the filesystem. Returns the number of pages freed."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA auto_vacuum")
+    incremental = cursor.fetchone()[0] == 2  # INCREMENTAL
+    cursor.execute("PRAGMA freelist_count")
+    free_before = cursor.fetchone()[0]
+
+    if not incremental and not full_vacuum:
+        telemetry.logger.warning(
+            "auto_vacuum is off for %s, so %d free pages can't be released; "
+            "run the archiver once with --full-vacuum to enable it", DB_PATH, free_before)
+        cursor.execute("PRAGMA optimize")
+        conn.close()
+        return 0
+
+    if not incremental:
+        # VACUUM can't run inside a transaction, and it's what applies the new auto_vacuum mode
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+    else:
+        # Small steps so live sessions can get the write lock in between
+        remaining = free_before
+        while remaining:
+            run_write(lambda c: c.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})").fetchall())
+            cursor.execute("PRAGMA freelist_count")
+            left = cursor.fetchone()[0]
+            if left >= remaining:  # Nothing more to release
+                break
+            remaining = left
+            time.sleep(ARCHIVE_BATCH_PAUSE_SECONDS)
+
+    # In WAL mode the file only shrinks once the freed pages are checkpointed
+    cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    cursor.fetchall()
+    cursor.execute("PRAGMA optimize")
+    cursor.execute("PRAGMA freelist_count")
+    free_after = cursor.fetchone()[0]
+    conn.close()
+    return max(free_before - free_after, 0)
+
+
+def get_archived_sessions(customer_phone):
+    """List a customer's archived sessions (metadata only, oldest first)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, customer_phone, session_start, session_end, message_count, archived_at
+        FROM conversation_archive
+        WHERE customer_phone = ?
+        ORDER BY session_start
+    """, (customer_phone,))
+    rows = cursor.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def rehydrate_session(archive_id):
+    """Decompress an archived session back into a list of messages.
+
+    Messages come back in the same shape as get_conversation_history returns.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT codec, payload FROM conversation_archive WHERE id = ?", (archive_id,))
+    row = cursor.fetchone()
+    conn.close()
+    if not row:
+        return []
+
+    stored = json.loads(_decompress(row["codec"], row["payload"]))
+    return [_row_to_message(r) for r in stored]
 
 
 # --- Booking Functions ---
 
 def save_booking(booking_data):
     """Save a booking to the database."""
-    conn = get_connection()
-    cursor = conn.cursor()
+    run_write(lambda cursor: _insert_booking(cursor, booking_data))
+
+
+def record_booking(booking_data, idempotency_key=None):
+    """Save a booking and upsert its customer in a single transaction.
+
+    `idempotency_key` is the tool_call_id of the book_appointment call. If a
+    booking with that key already exists, nothing is written and the
+    existing booking is returned, so a retried tool call can't double-book.
+    Returns None when a new booking was saved.
+    """
+    def work(cursor):
+        if idempotency_key:
+            cursor.execute("SELECT * FROM bookings WHERE idempotency_key = ?", (idempotency_key,))
+            existing = cursor.fetchone()
+            if existing:
+                return dict(existing)
+
+        _insert_booking(cursor, booking_data, idempotency_key)
+        _upsert_customer(cursor, booking_data["customer_name"], booking_data.get("phone", ""),
+                         booking_data["address"])
+        return None
+
+    return run_write(work)
+
+
+def _insert_booking(cursor, booking_data, idempotency_key=None):
     cursor.execute("""
         INSERT INTO bookings (
             confirmation_number, customer_name, customer_phone, address,
             service_category, issue_description, preferred_date,
-            preferred_time, urgency, status
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            preferred_time, urgency, status, idempotency_key
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (
         booking_data["confirmation_number"],
         booking_data["customer_name"],
@@ -165,10 +519,9 @@ def save_booking(booking_data):
         booking_data["preferred_date"],
         booking_data["preferred_time"],
         booking_data["urgency"],
-        booking_data["status"]
+        booking_data["status"],
+        idempotency_key
     ))
-    conn.commit()
-    conn.close()
 
 
 def get_customer_bookings(phone):
@@ -183,3 +536,20 @@ def get_customer_bookings(phone):
     rows = cursor.fetchall()
     conn.close()
     return [dict(row) for row in rows]
+
+
+if __name__ == "__main__":
+    # Run this directly (e.g. from cron) to compact old conversations
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Archive old conversation history")
+    parser.add_argument("--max-age-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--keep-recent", type=int, default=HOT_MESSAGES_PER_CUSTOMER)
+    parser.add_argument("--full-vacuum", action="store_true",
+                        help="One-time VACUUM to turn on incremental vacuum for an older database")
+    args = parser.parse_args()
+
+    init_db()
+    stats = archive_old_conversations(args.max_age_days, args.keep_recent, args.full_vacuum)
+    print(f"Archived {stats['archived_messages']} messages in {stats['archived_sessions']} sessions, "
+          f"freed {stats['freed_pages']} pages.")
@@ -1,8 +1,10 @@
 import os
+import re
 import json
 import numpy as np
 from openai import OpenAI
 from dotenv import load_dotenv
+import telemetry
 
 load_dotenv()
 
@@ -10,50 +12,248 @@ client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 KNOWLEDGE_DIR = "knowledge"
 EMBEDDINGS_CACHE = "knowledge_embeddings.json"
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Chunking settings (in estimated tokens, see count_tokens)
+MAX_CHUNK_TOKENS = 200
+MIN_CHUNK_TOKENS = 40
+CHUNK_OVERLAP_TOKENS = 30
+CONTEXT_SHARE = 0.5            # Most of a chunk the "TITLE > SECTION" prefix may take up
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+
+# Search settings
+MIN_SIMILARITY = 0.25          # Chunks scoring below this are never returned
+MMR_LAMBDA = 0.7               # 1.0 = rank purely by relevance, lower = favor diversity
+MMR_CANDIDATES = 10            # How many top-scoring chunks MMR chooses from
+DUPLICATE_SIMILARITY = 0.92    # Same-file chunks this similar to a picked one are dropped
+RESULT_TOKEN_BUDGET = 400      # Combined size of the chunks returned by one search
+
+_index = None
+
+
+def count_tokens(text):
+    """Estimate the token count of a piece of text (about four characters per token)."""
+    return max(1, (len(text) + 3) // 4)
+
+
+def _fits(text, max_tokens):
+    """True if `text`, plus the space or newline that joins it to a chunk, fits in `max_tokens`."""
+    return count_tokens(" " + text) <= max_tokens
+
+
+def _is_heading(line):
+    """Section headings in the knowledge files are all-caps lines, e.g. 'LABOR WARRANTY:'."""
+    return (
+        any(c.isalpha() for c in line)
+        and line == line.upper()
+        and not line.startswith("-")
+        and len(line) <= 80
+    )
+
+
+def _read_blocks(filepath):
+    """Stream a document line by line as ("title" | "heading" | "paragraph", value) blocks.
+
+    The first non-empty line is the document title. Paragraphs are lists of
+    consecutive non-empty lines.
+    """
+    title_seen = False
+    paragraph = []
+
+    with open(filepath, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+
+            if not line:
+                if paragraph:
+                    yield "paragraph", paragraph
+                    paragraph = []
+                continue
+
+            if not title_seen:
+                title_seen = True
+                yield "title", line
+            elif _is_heading(line):
+                if paragraph:
+                    yield "paragraph", paragraph
+                    paragraph = []
+                yield "heading", line.rstrip(":")
+            else:
+                paragraph.append(line)
+
+    if paragraph:
+        yield "paragraph", paragraph
+
+
+def _paragraph_units(lines, max_tokens):
+    """Split a paragraph into sentence units no larger than `max_tokens`.
+
+    The limit includes the separator _make_chunk puts in front of the unit.
+    Each unit is (text, starts_line) so that lines (bullets, Q:/A:) can be
+    rejoined with newlines and sentences within a line with spaces.
+    """
+    for line in lines:
+        for i, sentence in enumerate(SENTENCE_BOUNDARY.split(line)):
+            starts_line = i == 0
+            if _fits(sentence, max_tokens):
+                yield sentence, starts_line
+                continue
+
+            # A single runaway sentence: fall back to word windows
+            words = sentence.split()
+            window = []
+            for word in words:
+                if not _fits(word, max_tokens):
+                    # No whitespace to split on (a long URL or encoded blob): cut by characters
+                    if window:
+                        yield " ".join(window), starts_line
+                        window, starts_line = [], False
+                    piece_chars = max_tokens * 4 - 1
+                    for start in range(0, len(word), piece_chars):
+                        yield word[start:start + piece_chars], starts_line
+                        starts_line = False
+                    continue
+                if window and not _fits(" ".join(window + [word]), max_tokens):
+                    yield " ".join(window), starts_line
+                    window, starts_line = [], False
+                window.append(word)
+            if window:
+                yield " ".join(window), starts_line
+
+
+def _make_chunk(source, context, units):
+    body = "".join(("\n" if starts_line else " ") + text for text, starts_line in units).strip()
+    content = f"{context}\n{body}" if context else body
+    return {
+        "source": source,
+        "heading": context,
+        "content": content,
+        "tokens": count_tokens(content),
+    }
+
+
+def chunk_document(filepath, max_tokens=None, min_tokens=None, overlap_tokens=None):
+    """Split one document into token-bounded chunks, reading it as a stream.
+
+    - Every chunk starts with its inherited context ("TITLE > SECTION") and
+      never spans two sections. The context is cut short if it would take
+      up more than CONTEXT_SHARE of `max_tokens`.
+    - Chunks end at paragraph boundaries once they reach `min_tokens`, so a
+      FAQ entry or guide section stays together while stray one-liners are
+      merged with what follows.
+    - A paragraph that doesn't fit in `max_tokens` is split between
+      sentences, and the next chunk repeats up to `overlap_tokens` worth of
+      trailing sentences so no answer is cut off without context.
+    """
+    max_tokens = max_tokens or MAX_CHUNK_TOKENS
+    min_tokens = min_tokens or MIN_CHUNK_TOKENS
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+
+    source = os.path.basename(filepath)
+    title = heading = None
+    context = ""
+    budget = max_tokens
+    units = []
+    size = 0  # Characters, counting the separator in front of each unit
+
+    for kind, value in _read_blocks(filepath):
+        if kind in ("title", "heading"):
+            if units:
+                yield _make_chunk(source, context, units)
+                units, size = [], 0
+            if kind == "title":
+                title = value
+            else:
+                heading = value
+            context = " > ".join(part for part in (title, heading) if part)
+            context = context[:int(max_tokens * CONTEXT_SHARE) * 4].rstrip()
+            budget = max(1, max_tokens - count_tokens(context))
+            continue
+
+        for unit in _paragraph_units(value, budget):
+            unit_chars = len(unit[0]) + 1
+            if units and size + unit_chars > budget * 4:
+                yield _make_chunk(source, context, units)
+
+                # Carry the trailing sentences forward as overlap
+                carried = []
+                carried_size = 0
+                for prev in reversed(units):
+                    prev_chars = len(prev[0]) + 1
+                    if (carried_size + prev_chars > overlap_tokens * 4
+                            or carried_size + prev_chars + unit_chars > budget * 4):
+                        break
+                    carried.insert(0, prev)
+                    carried_size += prev_chars
+                units, size = carried, carried_size
+
+            units.append(unit)
+            size += unit_chars
+
+        # Paragraph boundary: a natural place to end the chunk once it's big enough
+        if size >= min_tokens * 4:
+            yield _make_chunk(source, context, units)
+            units, size = [], 0
+
+    if units:
+        yield _make_chunk(source, context, units)
 
 
 def load_documents():
     """Load all text files from the knowledge directory and split into chunks."""
     chunks = []
 
-    for filename in os.listdir(KNOWLEDGE_DIR):
+    for filename in sorted(os.listdir(KNOWLEDGE_DIR)):
         if not filename.endswith(".txt"):
             continue
 
         filepath = os.path.join(KNOWLEDGE_DIR, filename)
-        with open(filepath, "r", encoding="utf-8") as f:
-            content = f.read()
+        chunks.extend(chunk_document(filepath))
 
-        # Split by double newlines to get natural sections
-        sections = content.split("\n\n")
+    return chunks
 
-        for section in sections:
-            section = section.strip()
-            if len(section) < 20:  # Skip tiny fragments
-                continue
 
-            chunks.append({
-                "source": filename,
-                "content": section
-            })
+def chunk_stats(chunks):
+    """Summarize chunk counts and token sizes per source file and overall."""
+    by_source = {}
+    for chunk in chunks:
+        by_source.setdefault(chunk["source"], []).append(chunk["tokens"])
+    by_source["(all)"] = [chunk["tokens"] for chunk in chunks]
 
-    return chunks
+    return {
+        source: {
+            "chunks": len(sizes),
+            "min_tokens": min(sizes) if sizes else 0,
+            "mean_tokens": sum(sizes) / len(sizes) if sizes else 0,
+            "max_tokens": max(sizes) if sizes else 0,
+            "total_tokens": sum(sizes),
+        }
+        for source, sizes in by_source.items()
+    }
 
 
 def get_embedding(text):
     """Get an embedding vector for a piece of text."""
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text
-    )
+    with telemetry.span("embeddings.create", model=EMBEDDING_MODEL) as span:
+        response = client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=text
+        )
+        if response.usage:
+            span.set(prompt_tokens=response.usage.prompt_tokens)
+            telemetry.incr("embeddings.prompt_tokens", response.usage.prompt_tokens)
     return response.data[0].embedding
 
 
-def cosine_similarity(a, b):
-    """Calculate cosine similarity between two vectors."""
-    a = np.array(a)
-    b = np.array(b)
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+def _cache_settings():
+    """Settings that change chunk boundaries or vectors; a mismatch invalidates the cache."""
+    return {
+        "embedding_model": EMBEDDING_MODEL,
+        "max_chunk_tokens": MAX_CHUNK_TOKENS,
+        "min_chunk_tokens": MIN_CHUNK_TOKENS,
+        "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+    }
 
 
 def build_knowledge_base():
@@ -62,11 +262,15 @@ def build_knowledge_base():
     This only needs to run once (or when documents change).
     Embeddings are cached to avoid re-calling the API.
     """
-    # Check if cache exists
+    # Check if cache exists and was built with the current chunking settings
+    settings = _cache_settings()
     if os.path.exists(EMBEDDINGS_CACHE):
-        print("Loading cached embeddings...")
         with open(EMBEDDINGS_CACHE, "r") as f:
-            return json.load(f)
+            cached = json.load(f)
+        if isinstance(cached, dict) and cached.get("settings") == settings:
+            print("Loading cached embeddings...")
+            return cached["chunks"]
+        print("Chunking settings changed since the cache was built.")
 
     print("Building knowledge base (generating embeddings)...")
     chunks = load_documents()
@@ -77,46 +281,133 @@ def build_knowledge_base():
 
     # Cache to disk
     with open(EMBEDDINGS_CACHE, "w") as f:
-        json.dump(chunks, f)
+        json.dump({"settings": settings, "chunks": chunks}, f)
 
     print(f"Knowledge base built: {len(chunks)} chunks embedded and cached.")
     return chunks
 
 
-def search_knowledge(query, top_k=3):
+def load_index():
+    """Return the knowledge base as arrays ready for vectorized search.
+
+    The index is built once per process (per cache file) instead of
+    re-reading the JSON cache on every search. Returns a dict with the
+    chunks, a row-normalized embedding matrix, per-chunk token counts and
+    source file names.
+    """
+    global _index
+
+    if _index is None or _index["cache_path"] != EMBEDDINGS_CACHE:
+        chunks = build_knowledge_base()
+        # Explicit 2-D shape so an empty corpus gives a (0, 0) matrix rather than a 1-D array
+        dimensions = len(chunks[0]["embedding"]) if chunks else 0
+        matrix = np.array([chunk["embedding"] for chunk in chunks], dtype=np.float32).reshape(len(chunks), dimensions)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+
+        _index = {
+            "cache_path": EMBEDDINGS_CACHE,
+            "chunks": chunks,
+            "matrix": matrix,
+            "tokens": np.array([chunk.get("tokens") or count_tokens(chunk["content"]) for chunk in chunks]),
+            "sources": np.array([chunk["source"] for chunk in chunks]),
+        }
+
+    return _index
+
+
+def _mmr_select(similarities, pairwise, same_source, top_k, mmr_lambda):
+    """Pick up to `top_k` candidates by maximal marginal relevance.
+
+    Each step takes the candidate with the best trade-off between relevance
+    to the query and redundancy with what's already picked. Candidates that
+    are near-duplicates of an already picked chunk from the same file are
+    dropped outright.
+    """
+    selected = []
+    available = np.ones(len(similarities), dtype=bool)
+
+    while len(selected) < top_k and available.any():
+        if selected:
+            redundancy = pairwise[:, selected].max(axis=1)
+        else:
+            redundancy = np.zeros(len(similarities))
+        scores = mmr_lambda * similarities - (1 - mmr_lambda) * redundancy
+        scores[~available] = -np.inf
+
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        available &= ~(same_source[best] & (pairwise[best] >= DUPLICATE_SIMILARITY))
+
+    return selected
+
+
+def search_knowledge(query, top_k=3, min_similarity=None, mmr_lambda=None, max_tokens=None):
     """Search the knowledge base for chunks most relevant to the query.
 
     Args:
         query: The user's question or search term
-        top_k: Number of results to return
+        top_k: Maximum number of results to return
+        min_similarity: Drop chunks scoring below this (default MIN_SIMILARITY)
+        mmr_lambda: Relevance vs. diversity trade-off, 1.0 = pure relevance (default MMR_LAMBDA)
+        max_tokens: Token budget for all returned chunks combined (default RESULT_TOKEN_BUDGET)
 
     Returns:
-        List of the most relevant chunks with similarity scores
+        List of the most relevant chunks with similarity scores. Weak matches
+        return fewer (possibly zero) chunks.
     """
-    # Load the knowledge base (from cache if available)
-    knowledge = build_knowledge_base()
+    min_similarity = MIN_SIMILARITY if min_similarity is None else min_similarity
+    mmr_lambda = MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    max_tokens = RESULT_TOKEN_BUDGET if max_tokens is None else max_tokens
+
+    # Load the knowledge base (built or read from cache on first use)
+    index = load_index()
+    if not index["chunks"] or top_k <= 0:
+        return []
 
-    # Embed the query
-    query_embedding = get_embedding(query)
+    # Embed the query and score every chunk at once
+    query_embedding = np.array(get_embedding(query), dtype=np.float32)
+    query_embedding /= np.linalg.norm(query_embedding) or 1
+    similarities = index["matrix"] @ query_embedding
 
-    # Calculate similarity for each chunk
-    results = []
-    for chunk in knowledge:
-        similarity = cosine_similarity(query_embedding, chunk["embedding"])
-        results.append({
-            "content": chunk["content"],
-            "source": chunk["source"],
-            "similarity": float(similarity)
-        })
+    # Shortlist the best candidates above the threshold
+    candidates = np.argsort(-similarities)[:MMR_CANDIDATES]
+    candidates = candidates[similarities[candidates] >= min_similarity]
+    if len(candidates) == 0:
+        return []
 
-    # Sort by similarity (highest first) and return top_k
-    results.sort(key=lambda x: x["similarity"], reverse=True)
-    return results[:top_k]
+    candidate_vectors = index["matrix"][candidates]
+    candidate_sources = index["sources"][candidates]
+    pairwise = candidate_vectors @ candidate_vectors.T
+    same_source = candidate_sources[:, None] == candidate_sources[None, :]
+
+    picked = candidates[_mmr_select(similarities[candidates], pairwise, same_source, top_k, mmr_lambda)]
+    if len(picked) == 0:
+        return []
+
+    # Keep results while they fit the token budget (the best one is always kept)
+    within_budget = np.cumsum(index["tokens"][picked]) <= max_tokens
+    within_budget[0] = True
+    picked = picked[within_budget]
+
+    return [
+        {
+            "content": index["chunks"][i]["content"],
+            "source": index["chunks"][i]["source"],
+            "similarity": float(similarities[i])
+        }
+        for i in picked
+    ]
 
 
 if __name__ == "__main__":
     # Run this directly to build/rebuild the knowledge base
-    build_knowledge_base()
+    knowledge = build_knowledge_base()
+    print("\nChunk statistics:")
+    for source, stats in chunk_stats(knowledge).items():
+        print(f"  {source:<28} {stats['chunks']:>3} chunks, "
+              f"{stats['min_tokens']}-{stats['max_tokens']} tokens (mean {stats['mean_tokens']:.0f})")
     print("\nTesting search...")
     results = search_knowledge("What is your warranty policy?")
     for r in results:
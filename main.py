@@ -2,14 +2,17 @@ import os
 import json
 from dotenv import load_dotenv
 from openai import OpenAI
-from prompts import SYSTEM_PROMPT
+from prompts import SYSTEM_PROMPT, session_context_prompt
 from tools import TOOLS, execute_tool
 from database import init_db, save_message, get_conversation_history
+import telemetry
 
 load_dotenv()
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+MODEL = "gpt-4o-mini"
+
 
 def chat(conversation_history, customer_phone=None):
     """Send the conversation to the LLM and get a response.
@@ -18,12 +21,24 @@ def chat(conversation_history, customer_phone=None):
     we execute it, feed the result back, and let the model continue.
     """
     while True:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=conversation_history,
-            tools=TOOLS,
-            temperature=0.7,
-        )
+        with telemetry.span("llm.chat", model=MODEL) as span:
+            response = client.chat.completions.create(
+                model=MODEL,
+                messages=conversation_history,
+                tools=TOOLS,
+                temperature=0.7,
+            )
+            if response.usage:
+                details = response.usage.prompt_tokens_details
+                cached_tokens = (details.cached_tokens if details else 0) or 0
+                span.set(
+                    prompt_tokens=response.usage.prompt_tokens,
+                    completion_tokens=response.usage.completion_tokens,
+                    cached_tokens=cached_tokens,
+                )
+                telemetry.incr("llm.prompt_tokens", response.usage.prompt_tokens)
+                telemetry.incr("llm.completion_tokens", response.usage.completion_tokens)
+                telemetry.incr("llm.cached_tokens", cached_tokens)
 
         message = response.choices[0].message
 
@@ -60,11 +75,11 @@ def chat(conversation_history, customer_phone=None):
             function_name = tool_call.function.name
             arguments = tool_call.function.arguments
 
-            print(f"  [Tool Call: {function_name}({arguments})]")
+            telemetry.log_event("tool_call", tool=function_name, arguments=arguments)
 
-            result = execute_tool(function_name, arguments)
+            result = execute_tool(function_name, arguments, tool_call.id)
 
-            print(f"  [Tool Result: {json.dumps(result)}]")
+            telemetry.log_event("tool_result", tool=function_name, result=result)
 
             tool_msg = {
                 "role": "tool",
@@ -78,9 +93,32 @@ def chat(conversation_history, customer_phone=None):
         # Loop back — the model will now generate a response using the tool results
 
 
+def start_conversation(customer_phone, today=None):
+    """Build the opening message list for a session.
+
+    Returns the conversation history (system prompt, session context and any
+    past messages for a returning customer) and the list of past messages
+    that were loaded. `today` overrides the date given to the model.
+    """
+    # Check if this is a returning customer by loading past conversation
+    past_messages = get_conversation_history(customer_phone)
+
+    # TOOLS plus SYSTEM_PROMPT are the same bytes for every request, so the
+    # provider's prompt cache can reuse them. The date and returning-customer
+    # note change per session and go after that prefix.
+    conversation_history = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": session_context_prompt(today, returning_customer=bool(past_messages))},
+    ]
+    conversation_history.extend(past_messages)
+
+    return conversation_history, past_messages
+
+
 def main():
-    # Initialize database on startup
+    # Initialize database and tracing on startup
     init_db()
+    telemetry.configure()
 
     print("=" * 50)
     print("  Pinnacle Home Services - Virtual Assistant")
@@ -94,24 +132,10 @@ def main():
         print("Phone number is required. Goodbye!")
         return
 
-    # Initialize conversation with the system prompt
-    conversation_history = [
-        {"role": "system", "content": SYSTEM_PROMPT}
-    ]
-
-    # Check if this is a returning customer by loading past conversation
-    past_messages = get_conversation_history(customer_phone)
+    conversation_history, past_messages = start_conversation(customer_phone)
     if past_messages:
         print(
             f"\n  [Returning customer detected - loading {len(past_messages)} previous messages]\n")
-        # Add a summary context message so the agent knows about the history
-        history_summary = {"role": "system", "content": (
-            "The following messages are from a previous conversation with this customer. "
-            "Use this context to provide a more personalized experience. "
-            "Welcome them back and reference their past interactions if relevant."
-        )}
-        conversation_history.append(history_summary)
-        conversation_history.extend(past_messages)
 
     # Get the agent's opening greeting
     greeting = chat(conversation_history, customer_phone)
@@ -125,6 +149,8 @@ def main():
             continue
         if user_input.lower() == "quit":
             print("\nThanks for contacting Pinnacle Home Services. Goodbye!")
+            if telemetry.ENABLED:
+                telemetry.log_event("summary", **telemetry.summary())
             break
 
         # Add user message to history and save to database
@@ -1,8 +1,11 @@
 from datetime import date
 
-SYSTEM_PROMPT = f"""You are the virtual assistant for Pinnacle Home Services, a local home services company based in Austin, Texas.
+# SYSTEM_PROMPT must stay byte-identical across sessions and days so that the
+# provider can cache it (together with the tool schemas) as a shared prompt
+# prefix. Anything that changes per session belongs in session_context_prompt().
+SYSTEM_PROMPT = """You are the virtual assistant for Pinnacle Home Services, a local home services company based in Austin, Texas.
 
-Today's date is {date.today().strftime("%B %d, %Y")}. Always use the current year when interpreting dates from the customer.
+Today's date is given in the session context message that follows these instructions. Always use the current year when interpreting dates from the customer.
 
 ## About the Company
 - Services offered: Plumbing, Electrical, and HVAC (heating, ventilation, air conditioning)
@@ -41,3 +44,18 @@ You are the first point of contact for potential customers reaching out for serv
 - If the customer asks about something outside your services (e.g., roofing, painting), politely let them know it's not a service you offer and suggest they check a local directory.
 - Once you have all the info, summarize the booking details and let the customer know a team member will confirm within 1 business hour.
 """
+
+RETURNING_CUSTOMER_PROMPT = (
+    "The following messages are from a previous conversation with this customer. "
+    "Use this context to provide a more personalized experience. "
+    "Welcome them back and reference their past interactions if relevant."
+)
+
+
+def session_context_prompt(today=None, returning_customer=False):
+    """Build the per-session system message sent right after SYSTEM_PROMPT."""
+    today = today or date.today()
+    content = f"Today's date is {today.strftime('%B %d, %Y')}."
+    if returning_customer:
+        content += "\n\n" + RETURNING_CUSTOMER_PROMPT
+    return content
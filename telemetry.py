@@ -0,0 +1,260 @@
+"""Lightweight tracing and metrics for the agent loop.
+
+Spans time LLM calls, tool executions, embedding requests and SQLite
+statements. Latencies are aggregated into p50/p95/p99 summaries and can be
+exported to a JSONL file or scraped from a Prometheus-style text endpoint.
+
+Everything is a no-op unless tracing is enabled, so normal runs pay nothing
+for the instrumentation.
+
+Environment:
+    ALETHIA_TRACE         - set to 1 to enable tracing
+    ALETHIA_TRACE_FILE    - optional JSONL file that every finished span is appended to
+    ALETHIA_METRICS_PORT  - optional port for a local /metrics endpoint
+    ALETHIA_LOG_LEVEL     - level for the structured "alethia" logger (e.g. DEBUG)
+"""
+import os
+import json
+import math
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ENABLED = os.getenv("ALETHIA_TRACE", "").lower() in ("1", "true", "yes")
+TRACE_FILE = os.getenv("ALETHIA_TRACE_FILE")
+MAX_SAMPLES = 10000  # Per span name, oldest samples are dropped first
+
+logger = logging.getLogger("alethia")
+
+_lock = threading.Lock()
+_durations = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+_counters = defaultdict(float)
+_trace_fh = None
+
+
+# --- Spans ---
+
+class Span:
+    """Times a block of code and records it under `name` when it exits."""
+
+    __slots__ = ("name", "attrs", "start")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+
+    def set(self, **attrs):
+        """Attach extra attributes, e.g. token counts known only after the call."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self.start) * 1000
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _record(self.name, duration_ms, self.attrs)
+        return False
+
+
+class _NoopSpan:
+    """Shared stand-in returned when tracing is disabled."""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name, **attrs):
+    """Return a context manager that times the enclosed block.
+
+    Usage:
+        with span("llm.chat", model="gpt-4o-mini") as s:
+            response = ...
+            s.set(prompt_tokens=response.usage.prompt_tokens)
+    """
+    if not ENABLED:
+        return _NOOP_SPAN
+    return Span(name, attrs)
+
+
+def incr(name, value=1):
+    """Add `value` to a running counter (e.g. total prompt tokens)."""
+    if not ENABLED or not value:
+        return
+    with _lock:
+        _counters[name] += value
+
+
+def _record(name, duration_ms, attrs):
+    """Store a finished span and append it to the trace file if configured."""
+    global _trace_fh
+
+    with _lock:
+        _durations[name].append(duration_ms)
+        if TRACE_FILE:
+            if _trace_fh is None:
+                _trace_fh = open(TRACE_FILE, "a", encoding="utf-8")
+            record = {"ts": time.time(), "span": name, "duration_ms": round(duration_ms, 3), **attrs}
+            _trace_fh.write(json.dumps(record, default=str) + "\n")
+            _trace_fh.flush()
+
+    log_event("span", span=name, duration_ms=round(duration_ms, 3), **attrs)
+
+
+# --- Control ---
+
+def enable(trace_file=None):
+    """Turn tracing on at runtime (optionally redirecting the JSONL output)."""
+    global ENABLED, TRACE_FILE, _trace_fh
+    with _lock:
+        ENABLED = True
+        if trace_file is not None and trace_file != TRACE_FILE:
+            if _trace_fh is not None:
+                _trace_fh.close()
+                _trace_fh = None
+            TRACE_FILE = trace_file
+
+
+def disable():
+    """Turn tracing off. Already collected samples are kept."""
+    global ENABLED
+    ENABLED = False
+
+
+def reset():
+    """Drop all collected samples and counters."""
+    with _lock:
+        _durations.clear()
+        _counters.clear()
+
+
+# --- Aggregation ---
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def percentiles(name):
+    """Return count, sum and p50/p95/p99 latency (ms) for a span name."""
+    with _lock:
+        values = sorted(_durations.get(name, ()))
+    return {
+        "count": len(values),
+        "sum_ms": sum(values),
+        "p50_ms": _percentile(values, 50),
+        "p95_ms": _percentile(values, 95),
+        "p99_ms": _percentile(values, 99),
+    }
+
+
+def counters():
+    """Return a snapshot of all counters."""
+    with _lock:
+        return dict(_counters)
+
+
+def summary():
+    """Return latency stats for every span name plus all counters."""
+    with _lock:
+        names = sorted(_durations)
+    return {
+        "spans": {name: percentiles(name) for name in names},
+        "counters": counters(),
+    }
+
+
+# --- Export ---
+
+def _metric_name(name):
+    return "alethia_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def render_prometheus():
+    """Render the current metrics in the Prometheus text exposition format."""
+    stats = summary()
+    lines = ["# TYPE alethia_span_duration_ms summary"]
+    for name, s in stats["spans"].items():
+        for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+            lines.append(f'alethia_span_duration_ms{{span="{name}",quantile="{quantile}"}} {s[key]:.3f}')
+        lines.append(f'alethia_span_duration_ms_sum{{span="{name}"}} {s["sum_ms"]:.3f}')
+        lines.append(f'alethia_span_duration_ms_count{{span="{name}"}} {s["count"]}')
+
+    for name, value in sorted(stats["counters"].items()):
+        metric = _metric_name(name) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value:g}")
+
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the chat output
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serve /metrics on a background thread and return the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+# --- Structured logging ---
+
+def log_event(event, **fields):
+    """Log a structured event as a single JSON line.
+
+    The isEnabledFor check comes first so that nothing is serialized when
+    the logger is disabled.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps({"event": event, **fields}, default=str))
+
+
+def configure():
+    """Apply logging and metrics-endpoint settings from the environment."""
+    level = os.getenv("ALETHIA_LOG_LEVEL")
+    if level:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("  [%(levelname)s] %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(level.upper())
+
+    port = os.getenv("ALETHIA_METRICS_PORT")
+    if ENABLED and port:
+        serve_metrics(int(port))
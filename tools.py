@@ -2,7 +2,8 @@ import json
 import random
 import string
 from datetime import datetime
-from database import save_booking, save_customer, get_customer_bookings
+from database import record_booking, get_customer_bookings
+import telemetry
 
 # --- Tool Definitions (schemas that tell the LLM what tools exist) ---
 
@@ -237,8 +238,12 @@ def get_price_estimate(service_category, job_type):
     }
 
 
-def book_appointment(customer_name, address, phone, service_category, issue_description, preferred_date, preferred_time, urgency):
-    """Book a service appointment and return a confirmation number."""
+def book_appointment(customer_name, address, phone, service_category, issue_description, preferred_date, preferred_time, urgency, idempotency_key=None):
+    """Book a service appointment and return a confirmation number.
+
+    `idempotency_key` is filled in by execute_tool from the tool_call_id, so
+    re-running the same tool call returns the original booking.
+    """
     conf_number = "PHS-" + "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
 
     booking = {
@@ -256,9 +261,15 @@ def book_appointment(customer_name, address, phone, service_category, issue_desc
         "message": f"Appointment booked successfully! Confirmation number: {conf_number}. A team member will call {phone} within 1 business hour to confirm the details."
     }
 
-    # Save to database
-    save_booking(booking)
-    save_customer(customer_name, phone, address)
+    # Save booking and customer together; an already-used key means this call was retried
+    existing = record_booking(booking, idempotency_key)
+    if existing:
+        return {
+            "confirmation_number": existing["confirmation_number"],
+            "status": existing["status"],
+            "already_booked": True,
+            "message": f"This appointment was already booked. Confirmation number: {existing['confirmation_number']}."
+        }
 
     return booking
 
@@ -267,6 +278,8 @@ def search_knowledge_base(query):
     """Search the knowledge base for relevant information."""
     from knowledge_base import search_knowledge
     results = search_knowledge(query, top_k=3)
+    if not results:
+        return {"results": [], "message": "No relevant information found in the knowledge base."}
     return {
         "results": [
             {"content": r["content"], "source": r["source"]}
@@ -301,11 +314,22 @@ TOOL_FUNCTIONS = {
 }
 
 
-def execute_tool(function_name, arguments):
-    """Execute a tool by name with the given arguments."""
+# Tools that write and must not repeat their side effects when a call is retried
+IDEMPOTENT_TOOLS = {"book_appointment"}
+
+
+def execute_tool(function_name, arguments, tool_call_id=None):
+    """Execute a tool by name with the given arguments.
+
+    For tools in IDEMPOTENT_TOOLS, `tool_call_id` is passed through as the
+    idempotency key.
+    """
     func = TOOL_FUNCTIONS.get(function_name)
     if not func:
         return {"error": f"Unknown tool: {function_name}"}
 
     args = json.loads(arguments) if isinstance(arguments, str) else arguments
-    return func(**args)
+    if function_name in IDEMPOTENT_TOOLS:
+        args = {**args, "idempotency_key": tool_call_id}
+    with telemetry.span(f"tool.{function_name}"):
+        return func(**args)